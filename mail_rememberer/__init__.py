@@ -0,0 +1 @@
+"""Daily email reminders for tasks, managed with the help of Mistral."""
@@ -0,0 +1,150 @@
+import functools
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+DOTENV_PATH = Path(__file__).resolve().parent.parent / ".env"
+DOTENV_CACHE_PATH = (
+    Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "mail-rememberer"
+    / "dotenv.json"
+)
+
+
+def _read_dotenv_cache(mtime_ns: int) -> dict[str, str] | None:
+    """Returns the cached .env values if they match the current file"""
+    try:
+        snapshot = orjson.loads(DOTENV_CACHE_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    # A snapshot of unexpected shape is treated like a missing one, the .env
+    # file is parsed again and the snapshot overwritten
+    if not isinstance(snapshot, dict):
+        return None
+    values = snapshot.get("values")
+    if (
+        snapshot.get("path") != str(DOTENV_PATH)
+        or snapshot.get("mtime_ns") != mtime_ns
+        or not isinstance(values, dict)
+        or not all(
+            isinstance(key, str) and isinstance(value, str)
+            for key, value in values.items()
+        )
+    ):
+        return None
+    return values
+
+
+def _write_dotenv_cache(mtime_ns: int, values: dict[str, str]):
+    snapshot = {"path": str(DOTENV_PATH), "mtime_ns": mtime_ns, "values": values}
+    try:
+        DOTENV_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # The snapshot contains secrets, so only the owner may read it. The
+        # mode passed to os.open only applies to newly created files, so an
+        # existing snapshot is restricted explicitly.
+        fd = os.open(DOTENV_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(fd, 0o600)
+            f.write(orjson.dumps(snapshot))
+    except OSError as e:
+        logger.debug("Could not cache the .env file: %s", e)
+
+
+def load_dotenv():
+    """Loads the .env file of the project into the environment.
+
+    The parsed values are cached keyed by the file's modification time, so
+    the file is only parsed again after it changed. Like python-dotenv,
+    variables that are already set are not overridden.
+    """
+    try:
+        mtime_ns = DOTENV_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        logger.debug("No .env file found at %s", DOTENV_PATH)
+        return
+
+    values = _read_dotenv_cache(mtime_ns)
+    if values is not None:
+        logger.debug("Loading environment variables from cached .env file")
+    else:
+        try:
+            import dotenv
+        except ImportError:
+            logger.info(
+                "The python-dotenv package is required to automatically load "
+                "environment variables from a .env file. Now, it's your "
+                "responsibility to load the .env file manually."
+            )
+            return
+        logger.debug("Loading environment variables from .env file")
+        values = {
+            key: value
+            for key, value in dotenv.dotenv_values(DOTENV_PATH).items()
+            if value is not None
+        }
+        _write_dotenv_cache(mtime_ns, values)
+
+    for key, value in values.items():
+        os.environ.setdefault(key, value)
+
+
+# Variables without a default, each one is needed for a full run
+_REQUIRED_VARIABLES = (
+    "RECEIVER_MAIL",
+    "POSTMARK_SERVER_API_TOKEN",
+    "MISTRAL_API_KEY",
+    "MISTRAL_MODEL",
+    "MESSAGE_DB_PATH",
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    is_dev: bool
+    receiver_mail: str
+    postmark_server_api_token: str
+    mistral_api_key: str
+    mistral_model: str
+    message_db_path: str
+    # Number of messages and tasks each kept by the read cache, 0 disables it
+    read_cache_size: int = 256
+
+    @classmethod
+    def from_env(cls) -> Self:
+        """Create Config from the environment, failing on missing variables"""
+        env = os.environ
+        missing = [name for name in _REQUIRED_VARIABLES if not env.get(name)]
+        if missing:
+            raise ValueError(
+                "Missing required environment variables: " + ", ".join(missing)
+            )
+
+        read_cache_size = env.get("READ_CACHE_SIZE", "256")
+        if not read_cache_size.isdigit():
+            raise ValueError(
+                "READ_CACHE_SIZE must be a non-negative integer, "
+                f"got {read_cache_size!r}"
+            )
+
+        return cls(
+            is_dev=env.get("ENV", "").casefold() == "dev",
+            receiver_mail=env["RECEIVER_MAIL"],
+            postmark_server_api_token=env["POSTMARK_SERVER_API_TOKEN"],
+            mistral_api_key=env["MISTRAL_API_KEY"],
+            mistral_model=env["MISTRAL_MODEL"],
+            message_db_path=env["MESSAGE_DB_PATH"],
+            read_cache_size=int(read_cache_size),
+        )
+
+
+@functools.cache
+def get_config() -> Config:
+    """Returns the configuration, loading the .env file on first use."""
+    load_dotenv()
+    return Config.from_env()
@@ -0,0 +1,591 @@
+import asyncio
+import functools
+import logging
+import queue
+import sqlite3
+import threading
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import date
+
+from mail_rememberer.config import get_config
+from mail_rememberer.models import (
+    INT_TO_STATUS,
+    STATUS_TO_INT,
+    Message,
+    Task,
+    TaskStatus,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Rows share only a handful of distinct dates, so parsing each ISO string once
+# and handing out the (immutable) date objects again is much cheaper than
+# calling date.fromisoformat for every column of every row.
+@functools.lru_cache(maxsize=1024)
+def _convert_date(value: bytes) -> date:
+    return date.fromisoformat(value.decode())
+
+
+# Columns declared as DATE are returned as date objects by the connections,
+# which are opened with detect_types=PARSE_DECLTYPES. In the other direction
+# date objects are bound as ISO strings, so the models can hand them over as
+# they are. The default adapters of sqlite3 are deprecated since Python 3.12,
+# hence both are registered explicitly.
+sqlite3.register_converter("DATE", _convert_date)
+sqlite3.register_adapter(date, date.isoformat)
+
+
+# The statements are kept as module constants, so every call passes the same
+# string to sqlite3 and hits its prepared statement cache.
+_GET_MSG_SQL = "SELECT id, added_at, message FROM messages WHERE id = ?"
+_GET_TASK_SQL = """
+    SELECT
+        id, added_at, last_modified_at, scheduled_for, scheduled_for_comment,
+        description, status, comment, from_message
+    FROM tasks WHERE id = ?
+"""
+_GET_TASK_STATUS_SQL = "SELECT status FROM tasks WHERE id = ?"
+_GET_MAIL_CACHE_SQL = "SELECT response FROM mail_cache WHERE prompt_hash = ?"
+_INSERT_MAIL_CACHE_SQL = """
+    INSERT OR REPLACE INTO mail_cache (prompt_hash, response, added_at)
+    VALUES (?, ?, ?)
+"""
+
+# Stored in PRAGMA user_version. Bump it whenever the schema changes in a way
+# that existing databases can not be read with, e.g. a changed column type.
+# Databases created before the schema was versioned report 0.
+_SCHEMA_VERSION = 1
+
+# The task states are seeded from STATUS_TO_INT, so the lookup table can not
+# get out of sync with the models. The values are plain integers and fixed
+# lowercase names, which makes inlining them into the script safe.
+_TASK_STATUS_VALUES = ", ".join(
+    f"({status_id}, '{name}')" for name, status_id in STATUS_TO_INT.items()
+)
+_SCHEMA_SQL = f"""
+    BEGIN;
+
+    -- AUTOINCREMENT guarantees that ids of deleted messages are never handed
+    -- out again, which the mail cache relies on as it is keyed by message ids.
+    CREATE TABLE IF NOT EXISTS messages
+    (
+        id       INTEGER PRIMARY KEY AUTOINCREMENT,
+        added_at DATE,
+        message  TEXT
+    );
+
+    -- Small lookup table of the task states, stored without a separate rowid
+    -- B-tree as it is only ever accessed by its primary key
+    CREATE TABLE IF NOT EXISTS task_status
+    (
+        id   INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    ) WITHOUT ROWID;
+    INSERT OR IGNORE INTO task_status (id, name) VALUES {_TASK_STATUS_VALUES};
+
+    CREATE TABLE IF NOT EXISTS tasks
+    (
+        id                    INTEGER PRIMARY KEY,
+        added_at              DATE,
+        last_modified_at      DATE,
+        scheduled_for         DATE,
+        scheduled_for_comment TEXT,
+        description           TEXT,
+        status                INTEGER NOT NULL DEFAULT 0,
+        comment               TEXT,
+        from_message          INTEGER,
+        FOREIGN KEY (status) REFERENCES task_status (id),
+        FOREIGN KEY (from_message) REFERENCES messages (id)
+    );
+
+    -- Mail bodies generated by the model, keyed by a hash of their input
+    CREATE TABLE IF NOT EXISTS mail_cache
+    (
+        prompt_hash TEXT PRIMARY KEY,
+        response    TEXT,
+        added_at    DATE
+    );
+
+    -- Serves the "open tasks due until ..." lookups of the mail generation
+    CREATE INDEX IF NOT EXISTS idx_tasks_status_sched
+        ON tasks (status, scheduled_for);
+    -- Due date lookups regardless of the status. Lookups by status alone are
+    -- already served by idx_tasks_status_sched.
+    CREATE INDEX IF NOT EXISTS idx_tasks_scheduled_for
+        ON tasks (scheduled_for);
+    -- SQLite does not index foreign key columns on its own
+    CREATE INDEX IF NOT EXISTS idx_tasks_from_message
+        ON tasks (from_message);
+
+    PRAGMA user_version = {_SCHEMA_VERSION};
+
+    COMMIT;
+"""
+
+# SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds, which bounds how many rows
+# fit into a single multi-row INSERT.
+_SQLITE_MAX_VARIABLE_NUMBER = 999
+
+# Columns written on insert, in the order of the to_db tuples of the models
+_MESSAGE_COLUMNS = ("added_at", "message")
+_TASK_COLUMNS = (
+    "added_at",
+    "last_modified_at",
+    "scheduled_for",
+    "scheduled_for_comment",
+    "description",
+    "status",
+    "comment",
+    "from_message",
+)
+
+
+@functools.cache
+def _bulk_insert_sql(table: str, columns: tuple[str, ...], n_rows: int) -> str:
+    """INSERT statement with n_rows VALUES groups, reused for equal sizes"""
+    group = "(" + ", ".join(["?"] * len(columns)) + ")"
+    values = ", ".join([group] * n_rows)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values}"
+
+
+def _configure_connection(conn: sqlite3.Connection):
+    """Apply the PRAGMAs every connection needs.
+
+    PRAGMAs are per connection, a connection opened without them would
+    silently run with foreign keys disabled. Must run before the first
+    transaction, as PRAGMA foreign_keys is a no-op inside one.
+    """
+    conn.executescript(
+        """
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA cache_size = -65536;
+        PRAGMA foreign_keys = ON;
+        PRAGMA mmap_size = 268435456;
+        """
+    )
+
+
+def get_connection(check_same_thread: bool = True) -> sqlite3.Connection:
+    # Transactions are managed explicitly with BEGIN/COMMIT, so that a unit of
+    # work is written with a single commit instead of one per statement.
+    conn = sqlite3.connect(
+        get_config().message_db_path,
+        isolation_level=None,
+        cached_statements=1024,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=check_same_thread,
+    )
+    conn.row_factory = sqlite3.Row
+    _configure_connection(conn)
+    return conn
+
+
+class SQLitePool:
+    """A small pool of configured connections to the message database.
+
+    Opening a connection includes setting up its PRAGMAs, which the pool only
+    pays once per connection. The connections may be used from other threads,
+    e.g. through asyncio.to_thread, but only by one user at a time. SQLite
+    serializes writers anyway, so a handful of connections is enough.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        """Hands out an idle connection, opening a new one if allowed.
+
+        Blocks until a connection is released if all of them are in use. Never
+        call this on the event loop thread, the coroutines holding the
+        connections could not run to release them. Use acquire_async there.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                conn = get_connection(check_same_thread=False)
+                self._opened += 1
+                return conn
+        return self._idle.get()
+
+    async def acquire_async(self) -> sqlite3.Connection:
+        """Like acquire, but waits for a connection in a worker thread."""
+        waiter = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            # Shielded, as the thread can not be stopped once it is waiting
+            return await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # Hand back the connection the thread eventually gets
+            def release_later(done: asyncio.Future[sqlite3.Connection]):
+                if not done.cancelled() and done.exception() is None:
+                    self.release(done.result())
+
+            waiter.add_done_callback(release_later)
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        # Never hand out a connection with a transaction left open
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @asynccontextmanager
+    async def connection_async(self) -> AsyncIterator[sqlite3.Connection]:
+        conn = await self.acquire_async()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Closes the idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_POOL: SQLitePool | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> SQLitePool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = SQLitePool()
+    return _POOL
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Runs the enclosed statements as a single transaction.
+
+    The connections are in autocommit mode, so without this every statement
+    would be committed on its own. The transaction is committed when the block
+    is left normally and rolled back on an exception. Either way the read
+    caches are cleared afterwards, as lookups made during the transaction may
+    have cached rows that were never committed or are outdated now.
+    """
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        clear_read_caches()
+
+
+@contextmanager
+def _savepoint(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Makes the enclosed statements atomic, inside or outside transaction().
+
+    Outside of a transaction the savepoint starts one of its own, which is
+    committed on release. Either way SQLite holds the write lock until the
+    savepoint is released, so rowids handed out inside it are contiguous.
+    """
+    conn.execute("SAVEPOINT insert_rows")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK TO insert_rows")
+        conn.execute("RELEASE insert_rows")
+        raise
+    else:
+        conn.execute("RELEASE insert_rows")
+
+
+def create_tables(conn: sqlite3.Connection):
+    """Create the schema in its own transaction.
+
+    executescript() commits a pending transaction before running the script,
+    so this must not be called inside transaction().
+    """
+    logger.info("Creating tables if they don't exist")
+    _check_schema_version(conn)
+    conn.executescript(_SCHEMA_SQL)
+
+
+def _check_schema_version(conn: sqlite3.Connection):
+    """Refuses databases created with an incompatible schema.
+
+    CREATE TABLE IF NOT EXISTS leaves existing tables as they are, so an old
+    database would otherwise only fail once its rows are read.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == _SCHEMA_VERSION:
+        return
+    if version == 0:
+        has_tables = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name IN ('messages', 'tasks')"
+        ).fetchone()
+        if has_tables is None:
+            return  # A new database, the schema script stamps it
+    raise RuntimeError(
+        f"The database uses schema version {version}, but version "
+        f"{_SCHEMA_VERSION} is required. Recreate the database or migrate it "
+        "manually, running with ENV=dev drops and recreates the tables."
+    )
+
+
+def _insert_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: tuple[str, ...],
+    models: list[Message] | list[Task],
+    bulk: bool = False,
+) -> list[int]:
+    """Insert models into table and set their ids, all or nothing.
+
+    With bulk, up to _SQLITE_MAX_VARIABLE_NUMBER values are written per
+    multi-row INSERT statement, which saves SQLite from stepping the statement
+    once per row as executemany does.
+    """
+    if not models:
+        return []
+    if any(model.id is not None for model in models):
+        name = type(models[0]).__name__
+        raise ValueError(
+            f"{name}.id should be None when inserting a new {name.lower()}"
+        )
+
+    rows = [model.to_db() for model in models]
+    with _savepoint(conn):
+        if bulk:
+            rows_per_statement = _SQLITE_MAX_VARIABLE_NUMBER // len(columns)
+            for start in range(0, len(rows), rows_per_statement):
+                chunk = rows[start:start + rows_per_statement]
+                conn.execute(
+                    _bulk_insert_sql(table, columns, len(chunk)),
+                    [value for row in chunk for value in row],
+                )
+        else:
+            conn.executemany(_bulk_insert_sql(table, columns, 1), rows)
+        # lastrowid is not set by executemany, so ask SQLite directly. The
+        # savepoint holds the write lock, so the rowids handed out inside it
+        # are contiguous.
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    clear_read_caches()
+    ids = list(range(last_id - len(rows) + 1, last_id + 1))
+    for model, model_id in zip(models, ids):
+        model.id = model_id  # also updates instances outside of this scope
+    return ids
+
+
+def insert_message(conn: sqlite3.Connection, message: Message) -> int:
+    return insert_messages(conn, [message])[0]
+
+
+def insert_messages(
+    conn: sqlite3.Connection, messages: list[Message]
+) -> list[int]:
+    """Insert several messages with a single executemany call.
+
+    The messages are written all or nothing. Wrap several writes in
+    transaction(), so that they are committed together.
+    """
+    logger.debug("Inserting messages %r", messages)
+    return _insert_rows(conn, "messages", _MESSAGE_COLUMNS, messages)
+
+
+def insert_messages_bulk(
+    conn: sqlite3.Connection, messages: list[Message]
+) -> list[int]:
+    """Insert many messages using multi-row INSERT statements."""
+    logger.debug("Bulk inserting %d messages", len(messages))
+    return _insert_rows(
+        conn, "messages", _MESSAGE_COLUMNS, messages, bulk=True
+    )
+
+
+def insert_task(conn: sqlite3.Connection, task: Task) -> int:
+    return insert_tasks(conn, [task])[0]
+
+
+def insert_tasks(conn: sqlite3.Connection, tasks: list[Task]) -> list[int]:
+    """Insert several tasks with a single executemany call.
+
+    The tasks are written all or nothing. Wrap several writes in
+    transaction(), so that they are committed together.
+    """
+    logger.debug("Inserting tasks %r", tasks)
+    return _insert_rows(conn, "tasks", _TASK_COLUMNS, tasks)
+
+
+def insert_tasks_bulk(conn: sqlite3.Connection, tasks: list[Task]) -> list[int]:
+    """Insert many tasks using multi-row INSERT statements."""
+    logger.debug("Bulk inserting %d tasks", len(tasks))
+    return _insert_rows(conn, "tasks", _TASK_COLUMNS, tasks, bulk=True)
+
+
+def _fetch_message_row(
+    conn: sqlite3.Connection, message_id: int
+) -> sqlite3.Row | None:
+    return conn.execute(_GET_MSG_SQL, (message_id,)).fetchone()
+
+
+def _fetch_task_row(
+    conn: sqlite3.Connection, task_id: int
+) -> sqlite3.Row | None:
+    return conn.execute(_GET_TASK_SQL, (task_id,)).fetchone()
+
+
+# The bound connection together with the key of its database in the caches
+type _Binding = tuple[sqlite3.Connection, str | sqlite3.Connection]
+
+_current_binding: ContextVar[_Binding] = ContextVar("current_binding")
+
+
+def _database_key(conn: sqlite3.Connection) -> str | sqlite3.Connection:
+    """Identifies the database conn is opened on within the read caches"""
+    path = conn.execute("PRAGMA database_list").fetchone()["file"]
+    # An in-memory database only exists for the connection that opened it
+    return path or conn
+
+
+@contextmanager
+def bind_connection(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Makes conn the connection used by the cached read functions.
+
+    The cached rows are kept per database, so connections to the same database,
+    like the ones of the pool, share them.
+    """
+    token = _current_binding.set((conn, _database_key(conn)))
+    try:
+        yield conn
+    finally:
+        _current_binding.reset(token)
+
+
+def _get_binding() -> _Binding:
+    try:
+        return _current_binding.get()
+    except LookupError:
+        raise RuntimeError(
+            "No connection is bound, wrap the lookup in bind_connection()"
+        ) from None
+
+
+# The database argument only keys the caches, the row is read through the bound
+# connection, which is opened on that database.
+def _lookup_message_row(
+    database: str | sqlite3.Connection, message_id: int
+) -> sqlite3.Row | None:
+    conn, _ = _current_binding.get()
+    return _fetch_message_row(conn, message_id)
+
+
+def _lookup_task_row(
+    database: str | sqlite3.Connection, task_id: int
+) -> sqlite3.Row | None:
+    conn, _ = _current_binding.get()
+    return _fetch_task_row(conn, task_id)
+
+
+type _RowLookup = Callable[[str | sqlite3.Connection, int], sqlite3.Row | None]
+
+
+# The caches hold the rows rather than the models: rows are immutable, while
+# a shared Message or Task could be modified by one caller behind the back of
+# all others. They are built on first use, so that importing this module does
+# not already require the configuration.
+@functools.cache
+def _read_caches() -> tuple[_RowLookup, _RowLookup]:
+    maxsize = get_config().read_cache_size
+    return (
+        functools.lru_cache(maxsize=maxsize)(_lookup_message_row),
+        functools.lru_cache(maxsize=maxsize)(_lookup_task_row),
+    )
+
+
+def get_message_by_id(message_id: int) -> Message | None:
+    """Looks up a message using the connection bound with bind_connection.
+
+    The row is cached, every call returns a new Message built from it.
+    """
+    _, database = _get_binding()
+    cached_message_row, _ = _read_caches()
+    row = cached_message_row(database, message_id)
+    if row is None:
+        return None
+    return Message.from_db(row)
+
+
+def get_task_by_id(task_id: int) -> Task | None:
+    """Looks up a task using the connection bound with bind_connection.
+
+    The row is cached, every call returns a new Task built from it.
+    """
+    _, database = _get_binding()
+    _, cached_task_row = _read_caches()
+    row = cached_task_row(database, task_id)
+    if row is None:
+        return None
+    return Task.from_db(row)
+
+
+def clear_read_caches():
+    """Drops all cached lookups.
+
+    Called by the write helpers, so the writing connection sees its own
+    changes, and by transaction() once the changes are committed or rolled
+    back, so that no lookup keeps serving rows of another state.
+    """
+    if _read_caches.cache_info().currsize == 0:
+        return  # Nothing has been looked up yet
+    for cache in _read_caches():
+        cache.cache_clear()
+
+
+def get_task_status(
+    conn: sqlite3.Connection, task_id: int
+) -> TaskStatus | None:
+    """Look up only the status of a task, without building the Task"""
+    row = conn.execute(_GET_TASK_STATUS_SQL, (task_id,)).fetchone()
+    if row is None:
+        return None
+    return INT_TO_STATUS[row["status"]]
+
+
+def get_cached_mail_body(
+    conn: sqlite3.Connection, prompt_hash: str
+) -> str | None:
+    row = conn.execute(_GET_MAIL_CACHE_SQL, (prompt_hash,)).fetchone()
+    if row is None:
+        return None
+    return row["response"]
+
+
+def insert_cached_mail_body(
+    conn: sqlite3.Connection, prompt_hash: str, response: str, today: date
+):
+    logger.debug("Caching mail body for prompt hash %s", prompt_hash)
+    conn.execute(_INSERT_MAIL_CACHE_SQL, (prompt_hash, response, today))
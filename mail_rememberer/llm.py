@@ -0,0 +1,369 @@
+import asyncio
+import copy
+import hashlib
+import logging
+import sqlite3
+from datetime import date
+
+import orjson
+from mistralai import Mistral
+from mistralai.utils import BackoffStrategy, RetryConfig
+
+from mail_rememberer.config import get_config
+from mail_rememberer.db import (
+    get_cached_mail_body,
+    insert_cached_mail_body,
+    insert_message,
+    insert_tasks,
+)
+from mail_rememberer.models import STATUS_TO_INT, Message, Task
+
+logger = logging.getLogger(__name__)
+
+
+tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "insert_task",
+            "description": "Insert a new task into the database",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "description": {
+                        "type": "string",
+                        "description": "A concise description of the task."
+                    },
+                    "comment": {
+                        "type": "string",
+                        "description": (
+                            "An optional comment from about how the task seems "
+                            "to be going, if he is interested and everything "
+                            "else that did not fit in the other fields. It "
+                            "will be passed to you the next time you ask for "
+                            "this function."
+                        )
+                    },
+                    "status": {
+                        "type": "string",
+                        "enum": list(STATUS_TO_INT),
+                        "description": (
+                            "The status of the task. Only use the ones "
+                            "listed. Don't use percentages or any other "
+                            "measure. If you need to supply additional "
+                            "information, use the comment field."
+                        )
+                    },
+                    "scheduled_for": {
+                        "type": "string",
+                        "format": "date",
+                        "description": (
+                            "The date when the task is scheduled to be "
+                            "completed."
+                        )
+                    },
+                    "scheduled_for_comment": {
+                        "type": "string",
+                        "description": (
+                            "An optional comment about the scheduled date. "
+                            "Use this when there is either no specific date, "
+                            "they talk about a range, or something else that "
+                            "is important."
+                        )
+                    }
+                },
+                "required": ["description", "status"]
+            }
+        }
+    }
+]
+
+# Kept constant and sent as a separate system message, so the same prefix is
+# reused for every request and can be served from Mistral's prompt cache.
+_EXTRACT_SYSTEM_PROMPT = (
+    "Extract multiple tasks from the message sent by the user and insert "
+    "them into the database using the insert_task function."
+)
+
+# The same tool, extended by the index of the message a task was found in, so
+# that several messages can be handled by a single request.
+batch_tools = copy.deepcopy(tools)
+batch_tools[0]["function"]["parameters"]["properties"]["source_index"] = {
+    "type": "integer",
+    "description": (
+        "The number of the SOURCE block the task was extracted from."
+    )
+}
+batch_tools[0]["function"]["parameters"]["required"].append("source_index")
+
+_BATCH_EXTRACT_SYSTEM_PROMPT = (
+    "The user sends several messages, each one in a block starting with "
+    "SOURCE followed by its number. Extract multiple tasks from each of the "
+    "messages and insert them into the database using the insert_task "
+    "function. Reference the message a task was found in with source_index."
+)
+
+# Rough upper bound for the messages of one batched request, which keeps the
+# prompt well within the context window of the Mistral models.
+_MAX_BATCH_CHARS = 50_000
+
+
+def _tool_call_arguments(response) -> list[dict]:
+    """Collects the arguments of all insert_task calls of a response"""
+    arguments: list[dict] = []
+    for choice in response.choices:
+        if choice.finish_reason == "tool_calls":
+            for tool_call in choice.message.tool_calls:
+                if tool_call.function.name == "insert_task":
+                    logger.debug(
+                        "Extracted task: %s", tool_call.function.arguments
+                    )
+                    arguments.append(orjson.loads(tool_call.function.arguments))
+                else:
+                    logger.warning(
+                        "Unknown tool call: %s", tool_call.function.name
+                    )
+        else:
+            logger.warning(
+                "Unexpected finish reason: %s, choice=%r",
+                choice.finish_reason,
+                choice,
+            )
+    return arguments
+
+
+async def extract_tasks_from_message_async(
+    mistral: Mistral, message: str, today: date | None = None
+) -> list[Task]:
+    """Extracts tasks from a message."""
+    # Resolve the date once, so all tasks of this message share it
+    today = today or date.today()
+    response = await mistral.chat.complete_async(
+        model=get_config().mistral_model,
+        messages=[
+            {
+                "role": "system",
+                "content": _EXTRACT_SYSTEM_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": message,
+            },
+        ],
+        tools=tools,
+        tool_choice="any",
+        parallel_tool_calls=True,
+    )
+    tasks: list[Task] = []
+    for task_desc in _tool_call_arguments(response):
+        try:
+            task = Task.from_llm_tool_call(task_desc, today)
+        except Exception as e:
+            logger.exception("The task could not be parsed!", exc_info=e)
+            continue
+        tasks.append(task)
+    return tasks
+
+
+async def extract_tasks_from_messages_async(
+    mistral: Mistral, messages: list[str], today: date | None = None
+) -> list[list[Task]]:
+    """Extracts the tasks of several messages with a single request.
+
+    Returns one list of tasks per message, in the order of the messages.
+    """
+    today = today or date.today()
+    prompt = "\n---\n".join(
+        f"SOURCE {index}:\n{message}" for index, message in enumerate(messages)
+    )
+    response = await mistral.chat.complete_async(
+        model=get_config().mistral_model,
+        messages=[
+            {
+                "role": "system",
+                "content": _BATCH_EXTRACT_SYSTEM_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": prompt,
+            },
+        ],
+        tools=batch_tools,
+        tool_choice="any",
+        parallel_tool_calls=True,
+    )
+    tasks: list[list[Task]] = [[] for _ in messages]
+    for task_desc in _tool_call_arguments(response):
+        source_index = task_desc.pop("source_index", None)
+        if (
+            not isinstance(source_index, int)
+            or source_index not in range(len(messages))
+        ):
+            logger.warning("Invalid source index %r, skipping task", source_index)
+            continue
+        try:
+            task = Task.from_llm_tool_call(task_desc, today)
+        except Exception as e:
+            logger.exception("The task could not be parsed!", exc_info=e)
+            continue
+        tasks[source_index].append(task)
+    return tasks
+
+
+def _batch_messages(messages: list[str]) -> list[list[str]]:
+    """Splits the messages into batches of at most _MAX_BATCH_CHARS each"""
+    batches: list[list[str]] = []
+    batch: list[str] = []
+    batch_chars = 0
+    for message in messages:
+        if batch and batch_chars + len(message) > _MAX_BATCH_CHARS:
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append(message)
+        batch_chars += len(message)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def extract_all(
+    mistral: Mistral, messages: list[str], today: date | None = None
+) -> list[list[Task]]:
+    """Extracts the tasks of several messages.
+
+    The messages are combined into as few requests as the context window
+    allows, and these requests are sent concurrently.
+    """
+    today = today or date.today()
+    results = await asyncio.gather(
+        *(
+            extract_tasks_from_messages_async(mistral, batch, today)
+            for batch in _batch_messages(messages)
+        )
+    )
+    return [tasks for batch_tasks in results for tasks in batch_tasks]
+
+
+async def generate_and_insert_sample_data(
+    mistral: Mistral, conn: sqlite3.Connection
+):
+    """Ask the Mistral model for a few examples and insert them into the database."""
+    logger.info("Generating sample data and inserting it")
+    today = date.today()
+
+    # Define a prompt for generating a sample message containing multiple tasks
+    message_prompt = (
+        "Generate a message that includes multiple tasks at different stages "
+        f"of completion. Today's date is {today.isoformat()}."
+    )
+
+    # Use the Mistral client to generate a sample message
+    messages_response = await mistral.chat.complete_async(
+        model=get_config().mistral_model,
+        messages=[
+            {
+                "role": "user",
+                "content": message_prompt,
+            }
+        ],
+        max_tokens=150,
+    )
+
+    # Parse the generated message
+    message_text = messages_response.choices[0].message.content.strip()
+
+    # Create and insert the message
+    message = Message.from_message(message_text, today)
+    message_id = insert_message(conn, message)
+
+    tasks = await extract_tasks_from_message_async(mistral, message_text, today)
+    insert_tasks(conn, tasks)
+
+    logger.info("Sample data generation and insertion completed")
+
+
+# Upper bound for the requests sent to Mistral at the same time, which keeps
+# the concurrent summaries within the rate limits of the API.
+_MAX_CONCURRENT_REQUESTS = 4
+
+# The SDK only retries rate limits (429) and server errors (5xx) with this, so
+# invalid requests still fail right away.
+_RETRY_CONFIG = RetryConfig(
+    "backoff",
+    BackoffStrategy(
+        initial_interval=500,
+        max_interval=60_000,
+        exponent=1.5,
+        max_elapsed_time=300_000,
+    ),
+    retry_connection_errors=True,
+)
+
+_SUMMARIZE_SYSTEM_PROMPT = (
+    "Summarize the message sent by the user in one or two sentences. Focus "
+    "on the tasks mentioned in it and how far along they are."
+)
+
+
+def _mail_body_hash(messages: list[Message]) -> str:
+    """Identifies the input of generate_mail_body for the mail cache.
+
+    Expects the messages in the order they appear in the body.
+    """
+    key = [
+        get_config().mistral_model,
+        _SUMMARIZE_SYSTEM_PROMPT,
+        [message.id for message in messages],
+    ]
+    return hashlib.blake2b(orjson.dumps(key)).hexdigest()
+
+
+async def generate_mail_body(
+    mistral: Mistral, conn: sqlite3.Connection, messages: list[Message]
+) -> str:
+    """Generates the body of the email by querying the model.
+
+    Each message is summarized by its own request. The requests are sent
+    concurrently, at most _MAX_CONCURRENT_REQUESTS at a time. Stored messages
+    never change, so the body is cached in the database by the ids of the
+    messages and reused when the same set of messages comes up again. The
+    summaries are ordered by message id, whatever order they are passed in.
+    """
+    if any(message.id is None for message in messages):
+        raise ValueError("Messages must be stored before generating a mail body")
+    if not messages:
+        return ""
+
+    messages = sorted(messages, key=lambda message: message.id)
+    prompt_hash = _mail_body_hash(messages)
+    body = get_cached_mail_body(conn, prompt_hash)
+    if body is not None:
+        logger.debug("Reusing cached mail body for prompt hash %s", prompt_hash)
+        return body
+
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+
+    async def summarize(message: Message) -> str:
+        async with semaphore:
+            response = await mistral.chat.complete_async(
+                model=get_config().mistral_model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": _SUMMARIZE_SYSTEM_PROMPT,
+                    },
+                    {
+                        "role": "user",
+                        "content": message.message,
+                    },
+                ],
+                retries=_RETRY_CONFIG,
+            )
+        summary = response.choices[0].message.content.strip()
+        return f"{message.added_at.isoformat()}: {summary}"
+
+    summaries = await asyncio.gather(*(summarize(m) for m in messages))
+    body = "\n\n".join(summaries)
+    insert_cached_mail_body(conn, prompt_hash, body, date.today())
+    return body
+
@@ -0,0 +1,17 @@
+import functools
+
+from postmarker.core import PostmarkClient
+
+from mail_rememberer.config import get_config
+
+
+@functools.cache
+def get_postmark() -> PostmarkClient:
+    """Returns the process-wide Postmark client, creating it on first use.
+
+    The client keeps its HTTP session, so later emails reuse the connection to
+    the Postmark API.
+    """
+    return PostmarkClient(
+        server_token=get_config().postmark_server_api_token
+    )
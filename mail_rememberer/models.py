@@ -0,0 +1,179 @@
+import sqlite3
+from dataclasses import dataclass
+from datetime import date
+from typing import Literal, Self, get_args
+
+
+@dataclass(slots=True)
+class Message:
+    id: int | None
+    added_at: date
+    message: str
+
+    @classmethod
+    def from_db(cls, row: sqlite3.Row) -> Self:
+        """Create Message instance from SQLite Row
+
+        The row needs the columns id, added_at and message, with added_at
+        already converted to a date by the connection.
+        """
+        # Positional arguments in field order, this is the hot hydration path
+        return cls(
+            row["id"],
+            row["added_at"],
+            row["message"],
+        )
+
+    def to_db(self) -> tuple[date, str]:
+        """Convert Message instance to tuple for DB insertion (excluding id)"""
+        return (self.added_at, self.message)
+
+    @classmethod
+    def from_message(cls, message: str, today: date | None = None) -> Self:
+        return cls(
+            id=None,
+            added_at=today or date.today(),
+            message=message,
+        )
+
+    def __str__(self):
+        return f"Message {self.id} ({self.added_at}):\n{self.message}"
+
+
+_TASK_STR_TEMPLATE = (
+    "\n"
+    "Task {id} ({added_at}):\n"
+    "{description}\n"
+    "Status: {status}\n"
+    "Comment: {comment}\n"
+    "Last modified at: {last_modified_at}\n"
+    "Scheduled for: {scheduled_for}\n"
+    "Scheduled for comment: {scheduled_for_comment}\n"
+)
+
+
+type TaskStatus = Literal["pending", "running", "completed", "failed"]
+
+# The status is stored as an integer, these ids must never change. Everything
+# else that lists the states, like the task_status table and the tool schema,
+# is derived from this mapping.
+STATUS_TO_INT: dict[TaskStatus, int] = {
+    "pending": 0,
+    "running": 1,
+    "completed": 2,
+    "failed": 3,
+}
+INT_TO_STATUS: dict[int, TaskStatus] = {
+    status_id: status for status, status_id in STATUS_TO_INT.items()
+}
+
+_VALID_STATUSES: frozenset[str] = frozenset(STATUS_TO_INT)
+# The Literal is only visible to type checkers, so it can't be derived
+assert _VALID_STATUSES == frozenset(get_args(TaskStatus.__value__))
+
+
+@dataclass(slots=True)
+class Task:
+    id: int | None
+    added_at: date
+    last_modified_at: date
+    scheduled_for: date | None
+    scheduled_for_comment: str | None
+    description: str
+    status: TaskStatus
+    comment: str
+    from_message: int | None = None
+
+    @classmethod
+    def from_description(
+        cls,
+        description: str,
+        from_message: int | None = None,
+        today: date | None = None,
+    ) -> Self:
+        today = today or date.today()
+        return cls(
+            id=None,
+            added_at=today,
+            last_modified_at=today,
+            scheduled_for=None,
+            scheduled_for_comment=None,
+            description=description,
+            status="pending",
+            comment="",
+            from_message=from_message,
+        )
+
+    @classmethod
+    def from_llm_tool_call(
+        cls, properties: dict[str, str], today: date | None = None
+    ) -> Self:
+        if not properties.get("description"):
+            raise ValueError("description must be provided")
+        if not properties.get("status"):
+            raise ValueError("status must be provided")
+        if properties["status"] not in _VALID_STATUSES:
+            raise ValueError("status must be one of pending, running, completed, failed")
+
+        scheduled_for = date.fromisoformat(properties["scheduled_for"]) if properties.get("scheduled_for") else None
+        scheduled_for_comment = properties["scheduled_for_comment"] if properties.get("scheduled_for_comment") else None
+        today = today or date.today()
+        return cls(
+            id=None,
+            added_at=today,
+            last_modified_at=today,
+            scheduled_for=scheduled_for,
+            scheduled_for_comment=scheduled_for_comment,
+            description=properties["description"],
+            status=properties["status"],
+            comment=properties.get("comment", ""),
+            from_message=None,
+        )
+
+    @classmethod
+    def from_db(cls, row: sqlite3.Row) -> Self:
+        """Create Task instance from SQLite Row
+
+        The row needs the columns id, added_at, last_modified_at,
+        scheduled_for, scheduled_for_comment, description, status, comment
+        and from_message, with the dates already converted by the connection.
+        """
+        # Positional arguments in field order, this is the hot hydration path
+        return cls(
+            row["id"],
+            row["added_at"],
+            row["last_modified_at"],
+            row["scheduled_for"],
+            row["scheduled_for_comment"],
+            row["description"],
+            INT_TO_STATUS[row["status"]],
+            row["comment"],
+            row["from_message"],
+        )
+
+    def to_db(
+        self,
+    ) -> tuple[date, date, date | None, str | None, str, int, str, int | None]:
+        """Convert Task instance to tuple for DB insertion (excluding id)"""
+        return (
+            self.added_at,
+            self.last_modified_at,
+            self.scheduled_for,
+            self.scheduled_for_comment,
+            self.description,
+            STATUS_TO_INT[self.status],
+            self.comment,
+            self.from_message,
+        )
+
+    def __str__(self):
+        return _TASK_STR_TEMPLATE.format(
+            id=self.id,
+            added_at=self.added_at.isoformat(),
+            description=self.description,
+            status=self.status,
+            comment=self.comment,
+            last_modified_at=self.last_modified_at.isoformat(),
+            scheduled_for=self.scheduled_for.isoformat() if self.scheduled_for else "None",
+            scheduled_for_comment=self.scheduled_for_comment or "None",
+        )